@@ -1,22 +1,14 @@
 import os
-import json
-import re
-import pandas as pd
 import numpy as np
-import cv2
 import gradio as gr
-from paddleocr import PaddleOCR
-import joblib
-from sklearn.ensemble import RandomForestClassifier
-from collections import Counter
-from datetime import datetime
-import tempfile
-from PIL import Image
+from PIL import Image, ImageOps
 
 # Import our modular components
 from utils.ocr_processor import OCRProcessor
 from utils.ml_classifier import EnhancedReceiptClassifier
-from utils.extractors import extract_dates_from_text, extract_pin_from_text
+
+# Longer image side in pixels; larger uploads are downscaled before OCR
+MAX_IMAGE_SIDE = 1600
 
 class ReceiptProcessorApp:
     def __init__(self):
@@ -46,66 +38,58 @@ class ReceiptProcessorApp:
     def process_receipt(self, image):
         """Process a single receipt image"""
         try:
-            # Convert Gradio image to temporary file
             if isinstance(image, str):
-                image_path = image
-            else:
-                # Save the image to a temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-                    image.save(tmp_file.name)
-                    image_path = tmp_file.name
+                # Apply the EXIF orientation that cv2.imread used to handle for file paths
+                image = ImageOps.exif_transpose(Image.open(image))
+            print(f"🔍 Processing image: {image.width}x{image.height}")
 
-            print(f"🔍 Processing image: {image_path}")
-
-            # Step 1: OCR Processing
-            with tempfile.TemporaryDirectory() as temp_dir:
-                json_path = self.ocr_processor.process_image(image_path, temp_dir)
-                
-                if not json_path or not os.path.exists(json_path):
-                    return {
-                        "Total Amount": "❌ OCR failed",
-                        "VAT Amount": "N/A",
-                        "Date": "N/A", 
-                        "PIN": "N/A",
-                        "Status": "OCR processing failed"
-                    }
+            # Convert first so palette and 16-bit uploads aren't resampled in their own mode
+            image = image.convert('RGB')
 
-                # Step 2: Load and process JSON data
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    json_data = json.load(f)
+            # Downscale large photos; PaddleOCR would shrink them for detection anyway
+            scale = MAX_IMAGE_SIDE / max(image.size)
+            if scale < 1:
+                size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                image = image.resize(size, Image.LANCZOS)
+            else:
+                scale = 1.0
 
-                # Step 3: Extract all fields
-                result = self.ml_classifier.predict_all_fields(json_data)
-                
-                # Format results for display
-                total_display = f"KES {result['total_amount']:,.2f}" if result['total_amount'] else "❌ Not found"
-                vat_display = f"KES {result['vat_amount']:,.2f}" if result['vat_amount'] else "⏸️ Not detected"
-                date_display = result['date'] if result['date'] else "⏸️ Not detected"
-                pin_display = result['pin'] if result['pin'] else "⏸️ Not detected"
-                
-                status = "✅ Success" if result['total_amount'] else "⚠️ Partial success"
+            # PaddleOCR accepts a BGR array directly, so uploads skip the disk round-trip
+            ocr_input = np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
 
-                # Clean up temporary image file if created
-                if 'tmp_file' in locals():
-                    os.unlink(image_path)
+            # Step 1: OCR Processing
+            ocr_data = self.ocr_processor.process_image(ocr_input, scale)
 
+            if ocr_data is None:
                 return {
-                    "Total Amount": total_display,
-                    "VAT Amount": vat_display,
-                    "Date": date_display,
-                    "PIN": pin_display,
-                    "Status": status
+                    "Total Amount": "❌ OCR failed",
+                    "VAT Amount": "N/A",
+                    "Date": "N/A", 
+                    "PIN": "N/A",
+                    "Status": "OCR processing failed"
                 }
 
+            # Step 2: Extract all fields
+            result = self.ml_classifier.predict_all_fields(ocr_data)
+            
+            # Format results for display
+            total_display = f"KES {result['total_amount']:,.2f}" if result['total_amount'] else "❌ Not found"
+            vat_display = f"KES {result['vat_amount']:,.2f}" if result['vat_amount'] else "⏸️ Not detected"
+            date_display = result['date'] if result['date'] else "⏸️ Not detected"
+            pin_display = result['pin'] if result['pin'] else "⏸️ Not detected"
+            
+            status = "✅ Success" if result['total_amount'] else "⚠️ Partial success"
+
+            return {
+                "Total Amount": total_display,
+                "VAT Amount": vat_display,
+                "Date": date_display,
+                "PIN": pin_display,
+                "Status": status
+            }
+
         except Exception as e:
             print(f"❌ Processing error: {e}")
-            # Clean up on error
-            if 'tmp_file' in locals():
-                try:
-                    os.unlink(image_path)
-                except:
-                    pass
-                    
             return {
                 "Total Amount": f"❌ Error: {str(e)}",
                 "VAT Amount": "N/A",
@@ -1,56 +1,95 @@
 import re
 from datetime import datetime
 
+# Patterns are compiled once at import instead of on every call
+_DATE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"(\d{4}[-/.]\d{2}[-/.]\d{2})",
+    r"(\d{2}[-/.]\d{2}[-/.]\d{4})",
+    r"(\d{2}\s*[A-Za-z]{3,9}\s*\d{4})",
+    r"([A-Za-z]{3,9}\s*\d{2},?\s*\d{4})",
+    r"(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})",
+)]
+
+_DATE_FORMATS = (
+    "%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d",
+    "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y",
+    "%m-%d-%Y", "%m/%d/%Y", "%m.%d.%Y",
+    "%d %b %Y", "%d %B %Y", "%b %d %Y", "%B %d %Y",
+)
+
+# The only formats that can parse a match of the same-index entry in _DATE_PATTERNS
+_FORMATS_BY_PATTERN = (
+    ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d"),
+    ("%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%m-%d-%Y", "%m/%d/%Y", "%m.%d.%Y"),
+    ("%d %b %Y", "%d %B %Y"),
+    ("%b %d %Y", "%B %d %Y"),
+    ("%d-%m-%Y", "%d/%m/%Y", "%m-%d-%Y", "%m/%d/%Y"),
+)
+
+# Every accepted date contains a four-digit year from 2020 to 2030
+_VALID_YEAR_RE = re.compile(r'20(?:2\d|30)')
+
+# All PIN patterns in one pass, one named group per pattern. Labelled PINs are
+# captured in a lookahead so a rejected candidate doesn't swallow a later label,
+# and "PIN NO" / "PIN/VAT" are tried before the plain "PIN" label.
+_PIN_COMBINED = re.compile(
+    r"PIN\s*NO\s*[:\-]?\s*(?=(?P<pin_no>[A-Z0-9]{8,15}))"
+    r"|PIN/VAT\s*[:\-]?\s*(?=(?P<pin_vat>[A-Z0-9]{8,15}))"
+    r"|PIN\s*[:\-]?\s*(?=(?P<pin>[A-Z0-9]{8,15}))"
+    r"|(?<!\w)(?P<bare>[A-Z]\d{8}[A-Z])(?!\w)"
+    r"|(?<!\w)(?P<bare_p>P\d{9}[A-Z])(?!\w)",
+    re.IGNORECASE
+)
+_PIN_PRIORITY = ('pin', 'pin_vat', 'pin_no', 'bare', 'bare_p')
+
+_PIN_STRIP_RE = re.compile(r'[-\s.]')
+
+_VALID_PIN_PATTERNS = [re.compile(p) for p in (
+    r'^[A-Z]\d{8,10}[A-Z]?$',
+    r'^P\d{9,10}[A-Z]?$',
+    r'^\d{8,11}$',
+)]
+
 def extract_dates_from_text(full_text):
     """Extract dates from receipt text"""
-    date_patterns = [
-        r"(\d{4}[-/.]\d{2}[-/.]\d{2})",
-        r"(\d{2}[-/.]\d{2}[-/.]\d{4})", 
-        r"(\d{2}\s*[A-Za-z]{3,9}\s*\d{4})",
-        r"([A-Za-z]{3,9}\s*\d{2},?\s*\d{4})",
-        r"(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})",
-    ]
-
-    for pattern in date_patterns:
-        matches = re.findall(pattern, full_text, re.IGNORECASE)
+    for pattern_idx, pattern in enumerate(_DATE_PATTERNS):
+        matches = pattern.findall(full_text)
         for match in matches:
-            cleaned_date = clean_and_validate_date(match)
+            cleaned_date = clean_and_validate_date(match, pattern_idx)
             if cleaned_date:
                 return cleaned_date
     return None
 
 def extract_pin_from_text(full_text):
     """Extract PIN numbers from receipt text"""
-    pin_patterns = [
-        r"(?:PIN\s*[:\-]?\s*([A-Z0-9]{8,15}))",
-        r"(?:PIN/VAT\s*[:\-]?\s*([A-Z0-9]{8,15}))",
-        r"(?:PIN\s*NO\s*[:\-]?\s*([A-Z0-9]{8,15}))",
-        r"(?<!\w)([A-Z]\d{8}[A-Z])(?!\w)",
-        r"(?<!\w)(P\d{9}[A-Z])(?!\w)",
-    ]
-
-    for pattern in pin_patterns:
-        matches = re.findall(pattern, full_text, re.IGNORECASE)
-        for match in matches:
-            cleaned_pin = clean_and_validate_pin(match)
+    # Keep the first valid PIN of each kind and return the highest-priority one
+    found = {}
+    for match in _PIN_COMBINED.finditer(full_text):
+        kind = match.lastgroup
+        if kind not in found:
+            cleaned_pin = clean_and_validate_pin(match.group(kind))
             if cleaned_pin:
-                return cleaned_pin
+                if kind == 'pin':
+                    return cleaned_pin
+                found[kind] = cleaned_pin
+    for kind in _PIN_PRIORITY:
+        if kind in found:
+            return found[kind]
     return None
 
-def clean_and_validate_date(date_string):
-    """Clean and validate date strings"""
+def clean_and_validate_date(date_string, pattern_idx=None):
+    """Clean and validate date strings, trying only the formats for pattern_idx when given"""
     if not date_string:
         return None
 
     cleaned = date_string.strip()
-    manual_formats = [
-        "%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d",
-        "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", 
-        "%m-%d-%Y", "%m/%d/%Y", "%m.%d.%Y",
-        "%d %b %Y", "%d %B %Y", "%b %d %Y", "%B %d %Y",
-    ]
-
-    for fmt in manual_formats:
+    # Cheap check first; most candidates would otherwise raise ValueError in strptime
+    if not _VALID_YEAR_RE.search(cleaned):
+        return None
+
+    formats = _DATE_FORMATS if pattern_idx is None else _FORMATS_BY_PATTERN[pattern_idx]
+
+    for fmt in formats:
         try:
             parsed_date = datetime.strptime(cleaned, fmt)
             if 2020 <= parsed_date.year <= 2030:
@@ -65,18 +104,12 @@ def clean_and_validate_pin(pin_string):
         return None
 
     cleaned = pin_string.strip().upper()
-    cleaned = re.sub(r'[-\s.]', '', cleaned)
+    cleaned = _PIN_STRIP_RE.sub('', cleaned)
 
     if len(cleaned) < 8 or len(cleaned) > 15:
         return None
 
-    pin_patterns = [
-        r'^[A-Z]\d{8,10}[A-Z]?$',
-        r'^P\d{9,10}[A-Z]?$',
-        r'^\d{8,11}$',
-    ]
-
-    for pattern in pin_patterns:
-        if re.match(pattern, cleaned):
+    for pattern in _VALID_PIN_PATTERNS:
+        if pattern.match(cleaned):
             return cleaned
     return None
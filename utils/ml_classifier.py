@@ -1,13 +1,40 @@
 import os
 import re
+from collections import namedtuple
 import numpy as np
-import joblib
 from .extractors import extract_dates_from_text, extract_pin_from_text
 
+# Decimal amounts or bare integers in a single pass; a decimal is matched
+# whole so its integer and fraction parts are not picked up again
+_AMOUNT_UNION = re.compile(r'\b\d+\.\d{2}\b|\b\d{2,}\b')
+_CLEAN_AMOUNT_RE = re.compile(r'[^\d,.]')
+
+_TOTAL_KEYWORDS = ("TOTAL", "AMOUNT DUE", "AMOUNT PAYABLE", "GRAND TOTAL", "BALANCE", "TOT")
+_VAT_KEYWORDS = ("VAT", "TAX", "GST")
+
+def _keyword_regex(keywords):
+    """Case-insensitive alternation of keywords, tolerating extra spaces between words"""
+    return re.compile(
+        '|'.join(r'\s+'.join(re.escape(word) for word in keyword.split()) for keyword in keywords),
+        re.IGNORECASE
+    )
+
+# Keyword matchers, case-insensitive so lines don't need upper()
+_TOTAL_RE = _keyword_regex(_TOTAL_KEYWORDS)
+_VAT_RE = _keyword_regex(_VAT_KEYWORDS)
+
 def normalize_y(poly):
     """Average vertical position of polygon"""
     return sum([p[1] for p in poly]) / len(poly)
 
+def normalize_ys(polys):
+    """Average vertical position of each polygon in one vectorised pass"""
+    try:
+        return np.asarray(polys, dtype=np.float64)[..., 1].mean(axis=-1)
+    except ValueError:
+        # Polygons with differing point counts can't form one array
+        return np.array([normalize_y(poly) for poly in polys], dtype=np.float64)
+
 def get_average_x(poly):
     """Get average X coordinate of a polygon"""
     return sum([p[0] for p in poly]) / len(poly)
@@ -16,49 +43,73 @@ def clean_amount(text):
     """Clean numeric amount from extracted text"""
     if not text:
         return None
-    cleaned = re.sub(r'[^\d,.]', '', str(text))
-    cleaned = cleaned.replace(',', '')
-    parts = cleaned.split('.')
-    if len(parts) > 2:
-        cleaned = ''.join(parts[:-1]) + '.' + parts[-1]
-    cleaned = cleaned.rstrip('.')
+    cleaned = str(text)
+    # Regex candidates are usually digits with at most one '.', which float() takes as-is
+    if not cleaned.replace('.', '', 1).isdecimal():
+        cleaned = _CLEAN_AMOUNT_RE.sub('', cleaned).replace(',', '')
+        # Only the last '.' is a decimal point
+        dot = cleaned.rfind('.')
+        if dot != -1:
+            cleaned = cleaned[:dot].replace('.', '') + cleaned[dot:]
+        cleaned = cleaned.rstrip('.')
     try:
         val = float(cleaned) if cleaned else None
         if val and 1 <= val <= 5000000:
             return val
         return None
-    except:
+    except ValueError:
         return None
 
-def extract_all_amounts(layout_data):
-    """Extract all potential amounts from the receipt"""
-    amounts = []
-    for text, poly, y_pos in layout_data:
-        patterns = [r'\b\d+\.\d{2}\b', r'\b\d{3,}\b']
-        for pattern in patterns:
-            matches = re.findall(pattern, text)
-            for match in matches:
-                amount = clean_amount(match)
-                if amount and amount >= 10:
-                    amounts.append({
-                        'amount': amount, 'text': text, 'y_pos': y_pos, 'poly': poly
-                    })
-    return amounts
-
-def extract_all_tax_amounts(layout_data):
-    """Extract all potential tax amounts from the receipt"""
-    tax_amounts = []
-    for text, poly, y_pos in layout_data:
-        patterns = [r'\b\d+\.\d{2}\b', r'\b\d{2,}\b']
-        for pattern in patterns:
-            matches = re.findall(pattern, text)
-            for match in matches:
-                amount = clean_amount(match)
-                if amount and amount >= 1:
-                    tax_amounts.append({
-                        'amount': amount, 'text': text, 'y_pos': y_pos, 'poly': poly
-                    })
-    return tax_amounts
+# Everything the total and VAT extractors need from one pass over the layout
+LayoutScan = namedtuple('LayoutScan', ['amounts', 'ys', 'tax_amounts', 'tax_ys', 'total_rows', 'vat_rows'])
+
+def scan_layout(layout_data):
+    """Collect amount candidates and total/VAT keyword lines in a single pass over the sorted layout"""
+    amounts, ys, tax_amounts, tax_ys = [], [], [], []
+    total_rows, vat_rows = [], []
+    for i, (text, poly, y_pos) in enumerate(layout_data):
+        # Totals take decimals and integers of 3+ digits; VAT also takes two-digit integers
+        for match in _AMOUNT_UNION.finditer(text):
+            candidate = match.group()
+            amount = clean_amount(candidate)
+            if amount:
+                tax_amounts.append(amount)
+                tax_ys.append(y_pos)
+                if amount >= 10 and ('.' in candidate or len(candidate) >= 3):
+                    amounts.append(amount)
+                    ys.append(y_pos)
+        if _TOTAL_RE.search(text):
+            total_rows.append(i)
+        if _VAT_RE.search(text):
+            vat_rows.append(i)
+    return LayoutScan(
+        np.array(amounts, dtype=np.float64),
+        np.array(ys, dtype=np.float64),
+        np.array(tax_amounts, dtype=np.float64),
+        np.array(tax_ys, dtype=np.float64),
+        total_rows,
+        vat_rows
+    )
+
+def max_amount_near(amounts, ys, y_pos):
+    """Largest amount on the same line as y_pos, or None (ys must be sorted ascending)"""
+    # Binary search narrows to a slightly wider window, then the exact
+    # |y - y_pos| < 5 test runs only on that slice
+    lo = np.searchsorted(ys, y_pos - 6, side='left')
+    hi = np.searchsorted(ys, y_pos + 6, side='right')
+    nearby = np.abs(ys[lo:hi] - y_pos) < 5
+    if nearby.any():
+        return float(amounts[lo:hi][nearby].max())
+    return None
+
+def _empty_result():
+    """Result with no fields found"""
+    return {
+        'total_amount': None,
+        'vat_amount': None,
+        'date': None,
+        'pin': None
+    }
 
 class EnhancedReceiptClassifier:
     def __init__(self):
@@ -69,6 +120,9 @@ class EnhancedReceiptClassifier:
     def load_models(self, total_model_path, vat_model_path=None):
         """Load ML models"""
         try:
+            # joblib is only needed when models are loaded, so keep it off the import path
+            import joblib
+
             # Load total model
             if os.path.exists(total_model_path):
                 self.total_model = joblib.load(total_model_path)
@@ -89,36 +143,44 @@ class EnhancedReceiptClassifier:
             return False
 
     def predict_all_fields(self, json_data):
-        """Extract all fields from JSON data"""
+        """Extract all fields from OCR data"""
         try:
             texts = json_data.get("rec_texts", [])
             polys = json_data.get("dt_polys", json_data.get("text_det_polys", []))
 
             if not texts or not polys:
-                return {
-                    'total_amount': None,
-                    'vat_amount': None,
-                    'date': None,
-                    'pin': None
-                }
-
-            # Create layout data
-            layout_data = []
-            for txt, poly in zip(texts, polys):
-                if txt and poly:
-                    layout_data.append((txt.strip(), poly, normalize_y(poly)))
-            layout_data.sort(key=lambda x: x[2])
+                return _empty_result()
+
+            # Create layout data, sorted top to bottom
+            y_positions = json_data.get("y_pos")
+            if y_positions is not None:
+                # OCRProcessor output is already sorted
+                layout_data = [(txt.strip(), poly, y_pos)
+                               for txt, poly, y_pos in zip(texts, polys, y_positions) if txt and poly]
+            else:
+                pairs = [(txt.strip(), poly) for txt, poly in zip(texts, polys) if txt and poly]
+                ys = normalize_ys([poly for _, poly in pairs]) if pairs else np.empty(0)
+                layout_data = [(*pairs[i], float(ys[i])) for i in np.argsort(ys, kind='stable')]
 
             full_text = " ".join(txt for txt, _, _ in layout_data)
 
+            # Every field needs a digit, so text without one can't yield anything
+            chars = set(full_text)
+            if not any(c.isdecimal() for c in chars):
+                return _empty_result()
+            # PINs always contain a letter, either in the "PIN" label or the PIN itself
+            has_alpha = any(c.isalpha() for c in chars)
+
+            # One pass over the layout feeds both the total and VAT extractors
+            scan = scan_layout(layout_data)
+
             # Extract fields
-            total_amount = self.extract_total_with_regex(layout_data, full_text)
+            total_amount = self.extract_total_with_regex(layout_data, full_text, scan)
             date = extract_dates_from_text(full_text)
-            pin = extract_pin_from_text(full_text)
+            pin = extract_pin_from_text(full_text) if has_alpha else None
             
             # Extract VAT
-            all_amounts = extract_all_amounts(layout_data)
-            vat_amount = self.extract_vat_with_regex(layout_data, full_text, all_amounts)
+            vat_amount = self.extract_vat_with_regex(layout_data, full_text, scan)
 
             return {
                 'total_amount': total_amount,
@@ -129,70 +191,56 @@ class EnhancedReceiptClassifier:
 
         except Exception as e:
             print(f"❌ Field extraction error: {e}")
-            return {
-                'total_amount': None,
-                'vat_amount': None, 
-                'date': None,
-                'pin': None
-            }
+            return _empty_result()
 
-    def extract_total_with_regex(self, layout_data, full_text):
+    def extract_total_with_regex(self, layout_data, full_text, scan=None):
         """Extract total amount using regex patterns"""
-        all_amounts = extract_all_amounts(layout_data)
-        if not all_amounts:
+        if scan is None:
+            scan = scan_layout(layout_data)
+        amounts, ys = scan.amounts, scan.ys
+        if not amounts.size:
             return None
 
         # Look for amounts near total keywords
-        total_keywords = ["TOTAL", "AMOUNT DUE", "AMOUNT PAYABLE", "GRAND TOTAL", "BALANCE", "TOT"]
-
-        for i, (text, poly, y_pos) in enumerate(layout_data):
-            text_upper = text.upper()
-
-            if any(keyword in text_upper for keyword in total_keywords):
-                # Amount in same line
-                line_amounts = [amt for amt in all_amounts if abs(amt['y_pos'] - y_pos) < 5]
-                if line_amounts:
-                    return max(line_amounts, key=lambda x: x['amount'])['amount']
-
-                # Amount in next line
-                if i + 1 < len(layout_data):
-                    next_text, next_poly, next_y = layout_data[i + 1]
-                    next_amounts = [amt for amt in all_amounts if abs(amt['y_pos'] - next_y) < 5]
-                    if next_amounts:
-                        return max(next_amounts, key=lambda x: x['amount'])['amount']
+        for i in scan.total_rows:
+            # Amount in same line
+            line_amount = max_amount_near(amounts, ys, layout_data[i][2])
+            if line_amount is not None:
+                return line_amount
+
+            # Amount in next line
+            if i + 1 < len(layout_data):
+                next_amount = max_amount_near(amounts, ys, layout_data[i + 1][2])
+                if next_amount is not None:
+                    return next_amount
 
         # Fallback to largest amount in bottom half
-        max_y = max(amt['y_pos'] for amt in all_amounts)
-        bottom_amounts = [amt for amt in all_amounts if amt['y_pos'] > max_y / 2]
-        if bottom_amounts:
-            return max(bottom_amounts, key=lambda x: x['amount'])['amount']
+        bottom = ys > ys.max() / 2
+        if bottom.any():
+            return float(amounts[bottom].max())
 
         # Final fallback: overall largest amount
-        return max(all_amounts, key=lambda x: x['amount'])['amount']
+        return float(amounts.max())
 
-    def extract_vat_with_regex(self, layout_data, full_text, all_amounts):
+    def extract_vat_with_regex(self, layout_data, full_text, scan=None):
         """Extract VAT amount using regex patterns"""
-        all_tax_amounts = extract_all_tax_amounts(layout_data)
-        if not all_tax_amounts:
+        if scan is None:
+            scan = scan_layout(layout_data)
+        tax_amounts, tax_ys = scan.tax_amounts, scan.tax_ys
+        if not tax_amounts.size:
             return None
 
         # Look for amounts near VAT keywords
-        vat_keywords = ["VAT", "TAX", "GST"]
-
-        for i, (text, poly, y_pos) in enumerate(layout_data):
-            text_upper = text.upper()
-
-            if any(keyword in text_upper for keyword in vat_keywords):
-                # Amount in same line
-                line_amounts = [amt for amt in all_tax_amounts if abs(amt['y_pos'] - y_pos) < 5]
-                if line_amounts:
-                    return max(line_amounts, key=lambda x: x['amount'])['amount']
-
-                # Amount in next line
-                if i + 1 < len(layout_data):
-                    next_text, next_poly, next_y = layout_data[i + 1]
-                    next_amounts = [amt for amt in all_tax_amounts if abs(amt['y_pos'] - next_y) < 5]
-                    if next_amounts:
-                        return max(next_amounts, key=lambda x: x['amount'])['amount']
+        for i in scan.vat_rows:
+            # Amount in same line
+            line_amount = max_amount_near(tax_amounts, tax_ys, layout_data[i][2])
+            if line_amount is not None:
+                return line_amount
+
+            # Amount in next line
+            if i + 1 < len(layout_data):
+                next_amount = max_amount_near(tax_amounts, tax_ys, layout_data[i + 1][2])
+                if next_amount is not None:
+                    return next_amount
 
         return None